@@ -1,134 +1,129 @@
 import os
 import sqlite3
+import time
 import psycopg2
-from psycopg2 import extras
 import hashlib
+import hmac
+import bcrypt
+from flask_compress import Compress
+import orjson
 import datetime
-from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from functools import wraps, lru_cache
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, make_response, Response
+from db import (init_app, init_db, close_db_connections, get_db_connection,
+                execute_prepared, execute_prepared_batch, transaction)
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 
-# =======================================================
-# Datenbank-Konfiguration
-# Wählt automatisch die richtige Datenbank basierend auf der Umgebungsvariable
-# =======================================================
-def get_db_connection():
-    """Stellt die Verbindung zur richtigen Datenbank her"""
-    if os.environ.get('DATABASE_URL'):
-        # PostgreSQL für die Produktion (z.B. auf Render)
-        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-        # Verwende DictCursor, um die Ausgabe wie bei sqlite3.Row zu erhalten
-        return conn, conn.cursor(cursor_factory=extras.DictCursor)
-    else:
-        # SQLite für die lokale Entwicklung
-        conn = sqlite3.connect('app.db')
-        conn.row_factory = sqlite3.Row
-        return conn, conn.cursor()
+# Antworten (v.a. JSON der Todo-API) mit Brotli bzw. gzip komprimieren
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html']
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
 
-def init_db():
-    """Datenbank und Tabellen initialisieren"""
-    conn, cur = get_db_connection()
+# Datenbank (PostgreSQL oder SQLite, siehe db.py)
+init_app(app)
 
-    if isinstance(conn, psycopg2.extensions.connection):
-        # SQL-Anweisungen für PostgreSQL
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                email TEXT,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS posts (
-                id SERIAL PRIMARY KEY,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                author_id INTEGER,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (author_id) REFERENCES users (id)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS todos (
-                id SERIAL PRIMARY KEY,
-                task TEXT NOT NULL,
-                completed BOOLEAN DEFAULT FALSE,
-                user_id INTEGER,
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-    else:
-        # SQL-Anweisungen für SQLite
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                email TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS posts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                author_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (author_id) REFERENCES users (id)
-            )
-        ''')
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS todos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                task TEXT NOT NULL,
-                completed BOOLEAN DEFAULT FALSE,
-                user_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
+def hash_password(password):
+    """Passwort mit bcrypt (gesalzen, Kostenfaktor 12) hashen"""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=12)).decode()
 
-    conn.commit()
-    cur.close()
-    conn.close()
+# Vergleichshash für unbekannte Benutzernamen, damit ein Login-Versuch immer
+# gleich lange dauert und nicht verrät, ob der Benutzer existiert
+DUMMY_PASSWORD_HASH = hash_password('')
 
-def hash_password(password):
-    """Passwort hashen"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def is_legacy_hash(stored):
+    """Prüft, ob es sich um einen alten, ungesalzenen SHA-256-Hash handelt"""
+    return not stored.startswith('$2')
+
+def verify_password(password, stored):
+    """Passwort gegen den gespeicherten Hash prüfen"""
+    if is_legacy_hash(stored):
+        # Alte SHA-256-Hashes werden beim nächsten Login auf bcrypt umgestellt
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+    return bcrypt.checkpw(password.encode(), stored.encode())
+
+@app.before_request
+def load_logged_in_user():
+    """Benutzer-ID einmal pro Request aus der Session laden"""
+    g.user_id = session.get('user_id')
 
 def login_required(f):
     """Decorator für geschützte Routen"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if g.user_id is None:
             flash('Bitte loggen Sie sich ein.', 'warning')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
+# =======================================================
+# Cache für die Startseite
+# Die neuesten Posts ändern sich nur, wenn ein Post erstellt wird
+# =======================================================
+RECENT_POSTS_TTL = 30
+_recent_posts_cache = {'posts': None, 'expires': 0.0}
+
+def get_recent_posts():
+    """Die neuesten Posts (werden kurzzeitig im Prozess zwischengespeichert)"""
+    now = time.monotonic()
+    if _recent_posts_cache['posts'] is not None and _recent_posts_cache['expires'] > now:
+        return _recent_posts_cache['posts']
+
+    conn, cur = get_db_connection()
+    execute_prepared(cur, 'recent_posts')
+    posts = [dict(post) for post in cur.fetchall()]
+
+    _recent_posts_cache.update(posts=posts, expires=now + RECENT_POSTS_TTL)
+    return posts
+
+def invalidate_recent_posts():
+    """Cache der Startseite verwerfen"""
+    _recent_posts_cache['posts'] = None
+
+def recent_posts_etag(posts):
+    """ETag für die Startseite (hängt auch vom eingeloggten Benutzer ab)"""
+    key = repr(([(post['id'], str(post['created_at'])) for post in posts], g.user_id))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+# =======================================================
+# Statische Seiten
+# Login, Registrierung und Fehlerseiten sind für anonyme Besucher immer gleich
+# =======================================================
+_static_pages = {}
+
+def render_static_page(template):
+    """Statische Seite einmal rendern und danach aus dem Cache liefern"""
+    # Eingeloggte Benutzer und Flash-Nachrichten verändern die Navigation bzw. den Inhalt
+    if app.debug or g.get('user_id') is not None or '_flashes' in session:
+        return render_template(template)
+    if template not in _static_pages:
+        _static_pages[template] = render_template(template)
+    return _static_pages[template]
+
 # === ROUTEN ===
 
 @app.route('/')
 def index():
     """Startseite mit aktuellen Blog-Posts"""
-    conn, cur = get_db_connection()
-    cur.execute('''
-        SELECT p.*, u.username 
-        FROM posts p 
-        JOIN users u ON p.author_id = u.id 
-        ORDER BY p.created_at DESC 
-        LIMIT 5
-    ''')
-    posts = cur.fetchall()
-    cur.close()
-    conn.close()
-    return render_template('index.html', posts=posts)
+    posts = get_recent_posts()
+
+    # Ausstehende Flash-Nachrichten müssen gerendert werden, sonst gilt der ETag
+    if '_flashes' in session:
+        return render_template('index.html', posts=posts)
+
+    etag = recent_posts_etag(posts)
+    # Flask-Compress hängt den Algorithmus an den ETag an (z.B. "...:br")
+    if any(tag.split(':')[0] == etag for tag in request.if_none_match.as_set()):
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template('index.html', posts=posts))
+    response.set_etag(etag)
+    response.vary.add('Cookie')
+    return response
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -140,7 +135,7 @@ def register():
         
         if not username or not password:
             flash('Benutzername und Passwort sind erforderlich!', 'error')
-            return render_template('register.html')
+            return render_static_page('register.html')
         
         conn, cur = get_db_connection()
         try:
@@ -154,11 +149,8 @@ def register():
         except (sqlite3.IntegrityError, psycopg2.errors.UniqueViolation):
             conn.rollback()
             flash('Benutzername bereits vergeben!', 'error')
-        finally:
-            cur.close()
-            conn.close()
     
-    return render_template('register.html')
+    return render_static_page('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -169,12 +161,22 @@ def login():
         
         conn, cur = get_db_connection()
         cur.execute(
-            'SELECT * FROM users WHERE username = %s AND password_hash = %s',
-            (username, hash_password(password))
+            'SELECT id, username, password_hash FROM users WHERE username = %s',
+            (username,)
         )
         user = cur.fetchone()
-        cur.close()
-        conn.close()
+        
+        if user is None:
+            verify_password(password, DUMMY_PASSWORD_HASH)
+        elif not verify_password(password, user['password_hash']):
+            user = None
+        
+        if user and is_legacy_hash(user['password_hash']):
+            cur.execute(
+                'UPDATE users SET password_hash = %s WHERE id = %s',
+                (hash_password(password), user['id'])
+            )
+            conn.commit()
         
         if user:
             session['user_id'] = user['id']
@@ -184,7 +186,7 @@ def login():
         else:
             flash('Ungültige Anmeldedaten!', 'error')
     
-    return render_template('login.html')
+    return render_static_page('login.html')
 
 @app.route('/logout')
 def logout():
@@ -199,22 +201,11 @@ def dashboard():
     """Benutzer-Dashboard"""
     conn, cur = get_db_connection()
     
-    # Benutzer-Posts
-    cur.execute(
-        'SELECT * FROM posts WHERE author_id = %s ORDER BY created_at DESC',
-        (session['user_id'],)
-    )
-    user_posts = cur.fetchall()
-    
-    # Benutzer-Todos
-    cur.execute(
-        'SELECT * FROM todos WHERE user_id = %s ORDER BY created_at DESC',
-        (session['user_id'],)
-    )
-    todos = cur.fetchall()
-    
-    cur.close()
-    conn.close()
+    # Benutzer-Posts und -Todos
+    execute_prepared(cur, 'user_dashboard', (g.user_id, g.user_id))
+    rows = cur.fetchall()
+    user_posts = [row for row in rows if row['kind'] == 'p']
+    todos = [row for row in rows if row['kind'] == 't']
     
     return render_template('dashboard.html', posts=user_posts, todos=todos)
 
@@ -232,15 +223,15 @@ def create_post():
         
         conn, cur = get_db_connection()
         cur.execute(
-            'INSERT INTO posts (title, content, author_id) VALUES (%s, %s, %s)',
-            (title, content, session['user_id'])
+            'INSERT INTO posts (title, content, author_id) VALUES (%s, %s, %s) RETURNING id',
+            (title, content, g.user_id)
         )
+        post = cur.fetchone()
         conn.commit()
-        cur.close()
-        conn.close()
+        invalidate_recent_posts()
         
         flash('Post erfolgreich erstellt!', 'success')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('view_post', post_id=post['id']))
     
     return render_template('create_post.html')
 
@@ -248,15 +239,8 @@ def create_post():
 def view_post(post_id):
     """Einzelnen Post anzeigen"""
     conn, cur = get_db_connection()
-    cur.execute('''
-        SELECT p.*, u.username 
-        FROM posts p 
-        JOIN users u ON p.author_id = u.id 
-        WHERE p.id = %s
-    ''', (post_id,))
+    execute_prepared(cur, 'post_by_id', (post_id,))
     post = cur.fetchone()
-    cur.close()
-    conn.close()
     
     if not post:
         flash('Post nicht gefunden!', 'error')
@@ -266,20 +250,25 @@ def view_post(post_id):
 
 # === TODO API ROUTEN ===
 
+# Wertebereich von INTEGER-Spalten (PostgreSQL)
+MIN_DB_INT = -2**31
+MAX_DB_INT = 2**31 - 1
+
+def is_valid_todo_id(value):
+    """Prüft, ob ein Wert als Todo-ID (INTEGER-Spalte) verwendet werden kann"""
+    return (isinstance(value, int) and not isinstance(value, bool)
+            and MIN_DB_INT <= value <= MAX_DB_INT)
+
 @app.route('/api/todos', methods=['GET'])
 @login_required
 def api_get_todos():
     """Todos als JSON zurückgeben"""
     conn, cur = get_db_connection()
-    cur.execute(
-        'SELECT * FROM todos WHERE user_id = %s ORDER BY created_at DESC',
-        (session['user_id'],)
-    )
+    execute_prepared(cur, 'user_todos', (g.user_id,))
     todos = cur.fetchall()
-    cur.close()
-    conn.close()
     
-    return jsonify([dict(todo) for todo in todos])
+    # orjson serialisiert deutlich schneller als das json-Modul der Standardbibliothek
+    return Response(orjson.dumps([dict(todo) for todo in todos]), mimetype='application/json')
 
 @app.route('/api/todos', methods=['POST'])
 @login_required
@@ -292,32 +281,26 @@ def api_create_todo():
         return jsonify({'error': 'Task ist erforderlich'}), 400
     
     conn, cur = get_db_connection()
-    cur.execute(
-        'INSERT INTO todos (task, user_id) VALUES (%s, %s) RETURNING id',
-        (task, session['user_id'])
-    )
+    execute_prepared(cur, 'create_todo', (task, g.user_id))
     todo = cur.fetchone()
     conn.commit()
-    cur.close()
-    conn.close()
     
-    return jsonify({'id': todo['id'], 'task': task, 'completed': False}), 201
+    return Response(orjson.dumps(dict(todo)), status=201, mimetype='application/json')
 
 @app.route('/api/todos/<int:todo_id>', methods=['PUT'])
 @login_required
 def api_update_todo(todo_id):
     """Todo aktualisieren (completed status)"""
     data = request.get_json()
+    if not is_valid_todo_id(todo_id) or not isinstance(data, dict):
+        return jsonify({'error': 'Ungültige Anfrage'}), 400
     completed = data.get('completed', False)
+    if not isinstance(completed, bool):
+        return jsonify({'error': 'completed muss true oder false sein'}), 400
     
     conn, cur = get_db_connection()
-    cur.execute(
-        'UPDATE todos SET completed = %s WHERE id = %s AND user_id = %s',
-        (completed, todo_id, session['user_id'])
-    )
+    execute_prepared(cur, 'update_todo', (completed, todo_id, g.user_id))
     conn.commit()
-    cur.close()
-    conn.close()
     
     return jsonify({'success': True})
 
@@ -325,45 +308,88 @@ def api_update_todo(todo_id):
 @login_required
 def api_delete_todo(todo_id):
     """Todo löschen"""
+    if not is_valid_todo_id(todo_id):
+        return jsonify({'error': 'Ungültige Todo-ID'}), 400
+    
     conn, cur = get_db_connection()
-    cur.execute(
-        'DELETE FROM todos WHERE id = %s AND user_id = %s',
-        (todo_id, session['user_id'])
-    )
+    execute_prepared(cur, 'delete_todo', (todo_id, g.user_id))
     conn.commit()
-    cur.close()
-    conn.close()
     
     return jsonify({'success': True})
 
+@app.route('/api/todos', methods=['PATCH'])
+@login_required
+def api_update_todos():
+    """Mehrere Todos auf einmal aktualisieren ([{id, completed}, ...])"""
+    items = request.get_json()
+    if not isinstance(items, list) or not all(
+        isinstance(item, dict)
+        and is_valid_todo_id(item.get('id'))
+        and isinstance(item.get('completed'), bool)
+        for item in items
+    ):
+        return jsonify({'error': 'Liste von Todos mit id und completed erwartet'}), 400
+
+    conn, cur = get_db_connection()
+    with transaction(conn):
+        execute_prepared_batch(cur, 'update_todo',
+                               [(item['completed'], item['id'], g.user_id) for item in items])
+
+    return jsonify({'success': True})
+
+@app.route('/api/todos', methods=['DELETE'])
+@login_required
+def api_delete_todos():
+    """Mehrere Todos auf einmal löschen ([id, ...])"""
+    ids = request.get_json()
+    if not isinstance(ids, list) or not all(is_valid_todo_id(todo_id) for todo_id in ids):
+        return jsonify({'error': 'Liste von Todo-IDs erwartet'}), 400
+
+    conn, cur = get_db_connection()
+    with transaction(conn):
+        execute_prepared_batch(cur, 'delete_todo', [(todo_id, g.user_id) for todo_id in ids])
+
+    return jsonify({'success': True})
+
 # === ERROR HANDLER ===
 
 @app.errorhandler(404)
 def not_found_error(error):
-    return render_template('404.html'), 404
+    return render_static_page('404.html'), 404
 
 @app.errorhandler(500)
 def internal_error(error):
-    return render_template('500.html'), 500
+    return render_static_page('500.html'), 500
 
 # === TEMPLATE FILTER ===
 
+@lru_cache(maxsize=1024)
+def format_datetime(value):
+    """Zeitstempel einmal parsen und formatieren, danach aus dem Cache liefern"""
+    if isinstance(value, str):
+        # fromisoformat akzeptiert das PostgreSQL-Format ('T') und das SQLite-Format (Leerzeichen)
+        value = datetime.datetime.fromisoformat(value)
+    return value.strftime('%d.%m.%Y %H:%M')
+
 @app.template_filter('datetime')
 def datetime_filter(value):
     """Datum formatieren"""
-    if isinstance(value, str):
-        # Annahme: PostgreSQL und SQLite speichern Datums-Strings in unterschiedlichen Formaten
-        try:
-            # Versuch, PostgreSQL-Format zu parsen
-            value = datetime.datetime.fromisoformat(value)
-        except ValueError:
-            # Fallback für SQLite-Format
-            value = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
-    return value.strftime('%d.%m.%Y %H:%M')
+    return format_datetime(value)
 
-if __name__ == '__main__':
-    # Initialisierung der Datenbank
+# =======================================================
+# Start
+# Mit `gunicorn --preload` (siehe gunicorn.conf.py) läuft das nur einmal im
+# Master-Prozess; die Worker erben Module und Templates per fork()
+# =======================================================
+with app.app_context():
     init_db()
-    
+for template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(template_name)
+
+# Verbindungen dürfen nicht über fork() hinweg geteilt werden
+close_db_connections()
+
+if __name__ == '__main__':
+    # Nur für die lokale Entwicklung, in der Produktion: `gunicorn app:app`
     # `debug=True` nur für lokale Entwicklung verwenden
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
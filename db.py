@@ -0,0 +1,353 @@
+import os
+import sqlite3
+import re
+import itertools
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+import click
+import psycopg2
+from psycopg2 import extras, extensions, pool
+from flask import g
+
+# =======================================================
+# Datenbank-Konfiguration
+# Wählt automatisch die richtige Datenbank basierend auf der Umgebungsvariable;
+# alle Abfragen verwenden %s-Platzhalter, für SQLite werden sie umgewandelt
+# =======================================================
+DATABASE_URL = os.environ.get('DATABASE_URL')
+SQLITE_PATH = 'app.db'
+# Pro Prozess braucht jeder Thread höchstens eine Verbindung; WEB_THREADS wird
+# auch von gunicorn.conf.py gelesen
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', WEB_THREADS))
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+_sqlite_local = threading.local()
+
+# Häufig genutzte Abfragen; unter PostgreSQL einmal pro Verbindung vorbereitet,
+# unter SQLite greift der Statement-Cache von sqlite3 (gleicher SQL-String)
+PREPARED_QUERIES = {
+    'recent_posts': '''
+        SELECT p.id, p.title, SUBSTR(p.content, 1, 201) AS excerpt, p.created_at, u.username
+        FROM posts p
+        JOIN users u ON p.author_id = u.id
+        ORDER BY p.created_at DESC
+        LIMIT 5
+    ''',
+    'post_by_id': '''
+        SELECT p.id, p.title, p.content, p.created_at, u.username
+        FROM posts p
+        JOIN users u ON p.author_id = u.id
+        WHERE p.id = %s
+    ''',
+    # Posts ('p') und Todos ('t') eines Benutzers in einem Roundtrip
+    'user_dashboard': '''
+        SELECT 'p' AS kind, id, title, SUBSTR(content, 1, 100) AS excerpt,
+               NULL AS task, NULL AS completed, created_at
+        FROM posts
+        WHERE author_id = %s
+        UNION ALL
+        SELECT 't', id, NULL, NULL, task, completed, created_at
+        FROM todos
+        WHERE user_id = %s
+        ORDER BY created_at DESC
+    ''',
+    'user_todos': '''
+        SELECT id, task, completed, created_at
+        FROM todos
+        WHERE user_id = %s
+        ORDER BY created_at DESC
+    ''',
+    'create_todo': '''
+        INSERT INTO todos (task, user_id) VALUES (%s, %s)
+        RETURNING id, task, completed, created_at
+    ''',
+    'update_todo': 'UPDATE todos SET completed = %s WHERE id = %s AND user_id = %s',
+    'delete_todo': 'DELETE FROM todos WHERE id = %s AND user_id = %s',
+}
+
+class PooledConnection(extensions.connection):
+    """psycopg2-Verbindung für den Pool: liefert DictCursor, läuft im Autocommit
+    und merkt sich ihre vorbereiteten Statements"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Verwende DictCursor, um die Ausgabe wie bei sqlite3.Row zu erhalten
+        self.cursor_factory = extras.DictCursor
+        # Lesende Requests sparen sich BEGIN/COMMIT; Einzelanweisungen sind ohnehin
+        # atomar, mehrere Schreibzugriffe laufen über transaction()
+        self.autocommit = True
+        self.prepared = set()
+
+def get_db_pool():
+    """Gibt den PostgreSQL-Connection-Pool zurück (wird beim ersten Zugriff angelegt)"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = pool.ThreadedConnectionPool(
+                    minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, dsn=DATABASE_URL,
+                    connection_factory=PooledConnection
+                )
+    return _db_pool
+
+def get_sqlite_connection():
+    """Gibt die SQLite-Verbindung des aktuellen Threads zurück"""
+    conn = getattr(_sqlite_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL erlaubt Lesen während Schreibzugriffen und spart fsyncs pro Commit
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA cache_size=-64000')
+        _sqlite_local.conn = conn
+    return conn
+
+@lru_cache(maxsize=256)
+def to_sqlite_placeholders(sql):
+    """%s-Platzhalter (psycopg2-Stil) in ?-Platzhalter für sqlite3 umwandeln"""
+    return sql.replace('%s', '?')
+
+class SQLiteCursor(sqlite3.Cursor):
+    """sqlite3-Cursor, der SQL mit %s-Platzhaltern wie psycopg2 akzeptiert"""
+    def execute(self, sql, params=()):
+        return super().execute(to_sqlite_placeholders(sql), params)
+
+    def executemany(self, sql, params_list):
+        return super().executemany(to_sqlite_placeholders(sql), params_list)
+
+def close_db_connections():
+    """Schließt Pool und SQLite-Verbindung des aktuellen Threads (z.B. vor fork())"""
+    global _db_pool
+    if _db_pool is not None:
+        _db_pool.closeall()
+        _db_pool = None
+
+    conn = getattr(_sqlite_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _sqlite_local.conn = None
+
+def get_db_connection():
+    """Stellt die Verbindung zur richtigen Datenbank her (eine Verbindung pro Request)"""
+    if 'db_conn' not in g:
+        # Ein Cursor pro Request, wird beim Teardown geschlossen
+        if DATABASE_URL:
+            # PostgreSQL für die Produktion (z.B. auf Render), aus dem Pool geliehen
+            g.db_conn = get_db_pool().getconn()
+            g.db_cursor = g.db_conn.cursor()
+        else:
+            # SQLite für die lokale Entwicklung
+            g.db_conn = get_sqlite_connection()
+            g.db_cursor = g.db_conn.cursor(SQLiteCursor)
+
+    return g.db_conn, g.db_cursor
+
+def prepare_statement(name):
+    """PREPARE-Anweisung für eine Abfrage aus PREPARED_QUERIES erzeugen"""
+    # %s-Platzhalter in $1, $2, ... umwandeln
+    counter = itertools.count(1)
+    body = re.sub(r'%s', lambda m: f'${next(counter)}', PREPARED_QUERIES[name])
+    return f'PREPARE {name} AS {body}'
+
+def execute_statement(name, param_count):
+    """EXECUTE-Anweisung für ein vorbereitetes Statement erzeugen"""
+    if not param_count:
+        return f'EXECUTE {name}'
+    return f'EXECUTE {name} ({", ".join(["%s"] * param_count)})'
+
+def ensure_prepared(cur, name):
+    """Statement aus PREPARED_QUERIES auf der Verbindung vorbereiten, falls nötig"""
+    conn = cur.connection
+    if name in conn.prepared:
+        return
+
+    # In einer offenen Transaktion würde ein Fehler die ganze Transaktion abbrechen
+    in_transaction = not conn.autocommit
+    if in_transaction:
+        cur.execute('SAVEPOINT ensure_prepared')
+    try:
+        cur.execute(prepare_statement(name))
+    except psycopg2.errors.DuplicatePreparedStatement:
+        # Ein früheres EXECUTE ist fehlgeschlagen, das PREPARE davor blieb aber
+        # auf dem Server bestehen
+        if in_transaction:
+            cur.execute('ROLLBACK TO SAVEPOINT ensure_prepared')
+    else:
+        if in_transaction:
+            cur.execute('RELEASE SAVEPOINT ensure_prepared')
+    conn.prepared.add(name)
+
+def execute_prepared(cur, name, params=()):
+    """Führt eine Abfrage aus PREPARED_QUERIES aus (PREPARE/EXECUTE unter PostgreSQL)"""
+    if not DATABASE_URL:
+        cur.execute(PREPARED_QUERIES[name], params)
+        return
+
+    statement = execute_statement(name, len(params))
+    conn = cur.connection
+    if name not in conn.prepared and conn.autocommit:
+        try:
+            # PREPARE und das erste EXECUTE werden zusammen in einem Roundtrip geschickt
+            cur.execute(f'{prepare_statement(name)}; {statement}', params)
+        except psycopg2.errors.DuplicatePreparedStatement:
+            # Ein früheres EXECUTE ist fehlgeschlagen, das PREPARE davor bleibt aber
+            # auf dem Server bestehen: vermerken und nur noch EXECUTE schicken
+            conn.prepared.add(name)
+        else:
+            conn.prepared.add(name)
+            return
+
+    # Innerhalb einer Transaktion über einen Savepoint vorbereiten
+    ensure_prepared(cur, name)
+    cur.execute(statement, params)
+
+def execute_prepared_batch(cur, name, params_list):
+    """Führt eine Abfrage aus PREPARED_QUERIES für viele Parametersätze aus"""
+    if not params_list:
+        return
+    if not DATABASE_URL:
+        cur.executemany(PREPARED_QUERIES[name], params_list)
+        return
+
+    ensure_prepared(cur, name)
+
+    # execute_batch schickt bis zu 100 EXECUTEs pro Roundtrip
+    statement = execute_statement(name, len(params_list[0]))
+    extras.execute_batch(cur, statement, params_list, page_size=100)
+
+@contextmanager
+def transaction(conn):
+    """Mehrere Anweisungen atomar ausführen (PostgreSQL läuft sonst im Autocommit)"""
+    postgres = isinstance(conn, extensions.connection)
+    if postgres:
+        conn.autocommit = False
+    try:
+        yield
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if postgres and not conn.closed:
+            conn.autocommit = True
+
+def release_db_connection(exception):
+    """Gibt die Verbindung am Ende des Requests zurück an den Pool"""
+    conn = g.pop('db_conn', None)
+    if conn is None:
+        return
+
+    cur = g.pop('db_cursor')
+    if DATABASE_URL:
+        # Offene Transaktionen verwerfen, defekte Verbindungen schließen
+        if not conn.closed:
+            cur.close()
+            conn.rollback()
+        get_db_pool().putconn(conn, close=bool(conn.closed))
+    else:
+        cur.close()
+        conn.rollback()
+
+def init_db():
+    """Datenbank und Tabellen initialisieren (nur wenn noch nicht geschehen)"""
+    conn, cur = get_db_connection()
+    postgres = isinstance(conn, psycopg2.extensions.connection)
+
+    with transaction(conn):
+        if postgres:
+            # Verhindert, dass mehrere Worker gleichzeitig das Schema anlegen
+            cur.execute('SELECT pg_advisory_xact_lock(42)')
+
+        cur.execute('CREATE TABLE IF NOT EXISTS schema_version (v INTEGER NOT NULL)')
+        cur.execute('SELECT v FROM schema_version')
+        if cur.fetchone() is None:
+            create_tables(cur, postgres)
+            cur.execute('INSERT INTO schema_version (v) VALUES (1)')
+
+@click.command('initdb')
+def initdb_command():
+    """Datenbank und Tabellen initialisieren"""
+    init_db()
+    click.echo('Datenbank initialisiert.')
+
+def create_tables(cur, postgres):
+    """Tabellen und Indizes anlegen"""
+    if postgres:
+        # SQL-Anweisungen für PostgreSQL
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                email TEXT,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS posts (
+                id SERIAL PRIMARY KEY,
+                title TEXT NOT NULL,
+                content TEXT NOT NULL,
+                author_id INTEGER,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (author_id) REFERENCES users (id)
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS todos (
+                id SERIAL PRIMARY KEY,
+                task TEXT NOT NULL,
+                completed BOOLEAN DEFAULT FALSE,
+                user_id INTEGER,
+                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+    else:
+        # SQL-Anweisungen für SQLite
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                email TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                content TEXT NOT NULL,
+                author_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (author_id) REFERENCES users (id)
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS todos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task TEXT NOT NULL,
+                completed BOOLEAN DEFAULT FALSE,
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+    # Indizes für die häufigsten Abfragen (identische Syntax in PostgreSQL und SQLite)
+    cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_posts_created ON posts (created_at DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_posts_author_created ON posts (author_id, created_at DESC)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_todos_user_created ON todos (user_id, created_at DESC)')
+
+def init_app(app):
+    """Datenbank-Teardown und CLI-Befehl bei der Flask-App registrieren"""
+    app.teardown_appcontext(release_db_connection)
+    app.cli.add_command(initdb_command)
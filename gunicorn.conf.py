@@ -0,0 +1,19 @@
+# Gunicorn-Konfiguration für die Produktion, Start mit: gunicorn app:app
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Ein Worker-Prozess pro nutzbarem CPU-Kern (WEB_CONCURRENCY überschreibt das,
+# z.B. in Containern mit CPU-Quota), je WEB_THREADS Threads. Der Connection-Pool
+# in db.py ist auf WEB_THREADS Verbindungen pro Worker begrenzt.
+if hasattr(os, 'sched_getaffinity'):
+    cpus = len(os.sched_getaffinity(0))
+else:
+    cpus = os.cpu_count() or 1
+workers = int(os.environ.get('WEB_CONCURRENCY', cpus))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+# App einmal im Master laden (Schema-Prüfung, Templates), die Worker teilen
+# den Speicher danach per fork() (Copy-on-Write)
+preload_app = True